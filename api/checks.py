@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+from . import fields
+
+
+@register()
+def check_compression_codec(app_configs, **kwargs):
+    codec = getattr(settings, "MESSAGE_COMPRESSION_CODEC", "zlib")
+    if codec not in fields.CODECS:
+        return [
+            Error(
+                f"MESSAGE_COMPRESSION_CODEC must be one of "
+                f"{', '.join(map(repr, fields.CODECS))}, not {codec!r}.",
+                id="api.E001",
+            )
+        ]
+    if codec == "zstd" and fields.zstandard is None:
+        return [
+            Error(
+                "MESSAGE_COMPRESSION_CODEC is 'zstd' but the 'zstandard' "
+                "package is not installed.",
+                hint="Install zstandard or use 'zlib'.",
+                id="api.E002",
+            )
+        ]
+    return []
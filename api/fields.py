@@ -0,0 +1,142 @@
+import base64
+import zlib
+
+from django.conf import settings
+from django.db import models
+from django.utils.functional import SimpleLazyObject
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+# Stored values starting with this character carry a codec marker, e.g.
+# "\x1ez:<base64 payload>". Anything else is legacy plain text.
+MARKER = "\x1e"
+CODEC_RAW = "r"
+CODEC_ZLIB = "z"
+CODEC_ZSTD = "s"
+
+# Values accepted by the MESSAGE_COMPRESSION_CODEC setting.
+CODECS = {"zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+DEFAULT_THRESHOLD = 4096
+
+
+def _compress(codec, data):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ImportError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor().compress(data)
+    return zlib.compress(data)
+
+
+def _decompress(codec, data):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ImportError("zstd decompression requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def is_compressed(stored):
+    return (
+        isinstance(stored, str)
+        and stored.startswith(MARKER)
+        and stored[1:2] in (CODEC_ZLIB, CODEC_ZSTD)
+        and stored[2:3] == ":"
+    )
+
+
+def encode(text, threshold=None, codec=None):
+    """
+    Return the stored form of ``text``, compressing it when it is at least
+    ``threshold`` characters long and compression actually saves space.
+    ``codec`` is a ``CODECS`` name; the setting is validated by a system check.
+    """
+    if threshold is None:
+        threshold = getattr(
+            settings, "MESSAGE_COMPRESSION_THRESHOLD", DEFAULT_THRESHOLD
+        )
+    if codec is None:
+        codec = getattr(settings, "MESSAGE_COMPRESSION_CODEC", "zlib")
+    codec = CODECS[codec]
+
+    if len(text) >= threshold:
+        payload = base64.b64encode(_compress(codec, text.encode("utf-8")))
+        stored = f"{MARKER}{codec}:{payload.decode('ascii')}"
+        if len(stored) < len(text):
+            return stored
+
+    # Escape plain text that would otherwise be mistaken for a marker.
+    if text.startswith(MARKER):
+        return f"{MARKER}{CODEC_RAW}:{text}"
+    return text
+
+
+def decode(stored):
+    """Return the plain text for a stored value."""
+    if stored.startswith(f"{MARKER}{CODEC_RAW}:"):
+        return stored[3:]
+    if not is_compressed(stored):
+        return stored
+    codec, payload = stored[1], stored[3:]
+    return _decompress(codec, base64.b64decode(payload)).decode("utf-8")
+
+
+class CompressedText(SimpleLazyObject):
+    """
+    Proxy for compressed content that only decompresses on first use, so rows
+    that are loaded but never rendered never pay for decompression.
+    """
+
+    def __init__(self, stored):
+        self.__dict__["stored"] = stored
+        super().__init__(lambda: decode(stored))
+
+    def __reduce__(self):
+        return (CompressedText, (self.stored,))
+
+    def __copy__(self):
+        return CompressedText(self.stored)
+
+    def __deepcopy__(self, memo):
+        result = CompressedText(self.stored)
+        memo[id(self)] = result
+        return result
+
+
+class CompressedTextField(models.TextField):
+    """
+    A TextField that transparently compresses long values.
+
+    Values shorter than ``MESSAGE_COMPRESSION_THRESHOLD`` are stored as-is,
+    so existing rows remain valid and can be compressed later with the
+    ``compress_messages`` management command. Note that database lookups
+    such as ``icontains`` only see the stored form, so searches have to
+    match compressed values in Python (see ``SearchMessagesView``).
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if is_compressed(value):
+            return CompressedText(value)
+        if value is not None and value.startswith(MARKER):
+            return decode(value)
+        return value
+
+    def to_python(self, value):
+        if isinstance(value, CompressedText):
+            return value
+        return super().to_python(value)
+
+    def get_prep_value(self, value):
+        if isinstance(value, CompressedText):
+            # Unchanged since it was loaded; write the stored form back as-is.
+            return value.stored
+        value = super().get_prep_value(value)
+        if value is None:
+            return value
+        return encode(value)
+
+    def value_to_string(self, obj):
+        return str(self.value_from_object(obj))
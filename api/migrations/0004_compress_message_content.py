@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-19 09:34
+
+import api.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_alter_message_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="content",
+            field=api.fields.CompressedTextField(),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from .fields import CompressedTextField
 
 
 class MessageThread(models.Model):
@@ -13,7 +14,7 @@ class Message(models.Model):
     sender = models.ForeignKey(
         User, related_name="sent_messages", on_delete=models.CASCADE
     )
-    content = models.TextField()
+    content = CompressedTextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -21,3 +22,30 @@ class Message(models.Model):
 
     def __str__(self):
         return f"From {self.sender} in thread {self.thread.id} at {self.created_at}"
+
+
+class ThreadReadState(models.Model):
+    """
+    Delivery and read receipts for one participant of a thread, stored as
+    high watermarks: every message in the thread with an id up to
+    ``last_delivered_message_id`` has been delivered to ``user``, and up to
+    ``last_read_message_id`` has been read. The ids are plain integers rather
+    than foreign keys so deleting a message never touches receipts.
+    """
+
+    thread = models.ForeignKey(
+        MessageThread, related_name="read_states", on_delete=models.CASCADE
+    )
+    user = models.ForeignKey(User, related_name="read_states", on_delete=models.CASCADE)
+    last_delivered_message_id = models.BigIntegerField(default=0)
+    last_read_message_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["thread", "user"], name="unique_thread_read_state"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user} in thread {self.thread_id}"
@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+class BasePresenceStore:
+    """
+    Tracks when users were last seen and who is typing in which thread.
+
+    Nothing is written to the database: entries simply expire after their
+    TTL, so heartbeats can arrive as often as clients like.
+    """
+
+    def __init__(self, online_ttl=60, typing_ttl=5, last_seen_ttl=86400):
+        self.online_ttl = online_ttl
+        self.typing_ttl = typing_ttl
+        self.last_seen_ttl = last_seen_ttl
+
+    def heartbeat(self, user_id):
+        raise NotImplementedError
+
+    def set_typing(self, thread_id, user_id):
+        raise NotImplementedError
+
+    async def aheartbeat(self, user_id):
+        await sync_to_async(self.heartbeat)(user_id)
+
+    async def aset_typing(self, thread_id, user_id):
+        await sync_to_async(self.set_typing)(thread_id, user_id)
+
+    def get_last_seen(self, user_ids):
+        """Return a ``{user_id: timestamp}`` dict for users seen recently."""
+        raise NotImplementedError
+
+    def get_typing(self, participants):
+        """
+        Given ``{thread_id: [user_id, ...]}``, return the subset of each
+        thread's participants that are currently typing.
+        """
+        raise NotImplementedError
+
+    def get_many(self, user_ids):
+        """Return presence (``online`` and ``last_seen``) for each user."""
+        now = time.time()
+        last_seen = self.get_last_seen(user_ids)
+        presence = {}
+        for user_id in user_ids:
+            seen = last_seen.get(user_id)
+            presence[user_id] = {
+                "online": seen is not None and now - seen < self.online_ttl,
+                "last_seen": (
+                    datetime.fromtimestamp(seen, tz=timezone.utc)
+                    if seen is not None
+                    else None
+                ),
+            }
+        return presence
+
+
+class InMemoryPresenceStore(BasePresenceStore):
+    """
+    Per-process presence store bounded to ``max_entries`` users and typing
+    entries. The least recently active entries are evicted first.
+    """
+
+    def __init__(self, max_entries=10000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self._last_seen = OrderedDict()
+        self._typing = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, entries, key, value, ttl, now):
+        entries[key] = value
+        entries.move_to_end(key)
+        # Entries are kept in activity order, so expired ones are at the front.
+        while entries and (
+            len(entries) > self.max_entries or now - next(iter(entries.values())) >= ttl
+        ):
+            entries.popitem(last=False)
+
+    def heartbeat(self, user_id):
+        now = time.time()
+        with self._lock:
+            self._touch(self._last_seen, user_id, now, self.last_seen_ttl, now)
+
+    def set_typing(self, thread_id, user_id):
+        now = time.time()
+        with self._lock:
+            self._touch(self._typing, (thread_id, user_id), now, self.typing_ttl, now)
+            self._touch(self._last_seen, user_id, now, self.last_seen_ttl, now)
+
+    # Updates never wait on I/O, so they can run on the event loop directly.
+    async def aheartbeat(self, user_id):
+        self.heartbeat(user_id)
+
+    async def aset_typing(self, thread_id, user_id):
+        self.set_typing(thread_id, user_id)
+
+    def get_last_seen(self, user_ids):
+        now = time.time()
+        with self._lock:
+            found = {user_id: self._last_seen.get(user_id) for user_id in user_ids}
+        return {
+            user_id: seen
+            for user_id, seen in found.items()
+            if seen is not None and now - seen < self.last_seen_ttl
+        }
+
+    def get_typing(self, participants):
+        now = time.time()
+        typing = {}
+        with self._lock:
+            for thread_id, user_ids in participants.items():
+                typing[thread_id] = [
+                    user_id
+                    for user_id in user_ids
+                    if now - self._typing.get((thread_id, user_id), 0) < self.typing_ttl
+                ]
+        return typing
+
+
+class CachePresenceStore(BasePresenceStore):
+    """
+    Presence store backed by a Django cache, so it can be shared between
+    processes (e.g. with Redis or Memcached). Memory is bounded by the cache
+    itself; every entry is written with its TTL as the cache timeout.
+    """
+
+    def __init__(self, cache_alias="default", key_prefix="presence", **kwargs):
+        super().__init__(**kwargs)
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _seen_key(self, user_id):
+        return f"{self.key_prefix}:seen:{user_id}"
+
+    def _typing_key(self, thread_id, user_id):
+        return f"{self.key_prefix}:typing:{thread_id}:{user_id}"
+
+    def heartbeat(self, user_id):
+        self.cache.set(self._seen_key(user_id), time.time(), self.last_seen_ttl)
+
+    def set_typing(self, thread_id, user_id):
+        now = time.time()
+        self.cache.set(self._seen_key(user_id), now, self.last_seen_ttl)
+        self.cache.set(self._typing_key(thread_id, user_id), now, self.typing_ttl)
+
+    async def aheartbeat(self, user_id):
+        await self.cache.aset(self._seen_key(user_id), time.time(), self.last_seen_ttl)
+
+    async def aset_typing(self, thread_id, user_id):
+        now = time.time()
+        await self.cache.aset(self._seen_key(user_id), now, self.last_seen_ttl)
+        await self.cache.aset(
+            self._typing_key(thread_id, user_id), now, self.typing_ttl
+        )
+
+    def get_last_seen(self, user_ids):
+        keys = {self._seen_key(user_id): user_id for user_id in user_ids}
+        return {keys[key]: seen for key, seen in self.cache.get_many(keys).items()}
+
+    def get_typing(self, participants):
+        keys = {
+            self._typing_key(thread_id, user_id): (thread_id, user_id)
+            for thread_id, user_ids in participants.items()
+            for user_id in user_ids
+        }
+        found = self.cache.get_many(keys)
+        typing = {thread_id: [] for thread_id in participants}
+        for key in found:
+            thread_id, user_id = keys[key]
+            typing[thread_id].append(user_id)
+        return typing
+
+
+_store = None
+
+
+def get_presence_store():
+    """Return the process-wide store configured by ``PRESENCE_BACKEND``."""
+    global _store
+    if _store is None:
+        backend = getattr(
+            settings, "PRESENCE_BACKEND", "api.presence.InMemoryPresenceStore"
+        )
+        options = getattr(settings, "PRESENCE_OPTIONS", {})
+        _store = import_string(backend)(**options)
+    return _store
@@ -0,0 +1,98 @@
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.db.models.functions import Greatest
+
+from .models import ThreadReadState
+
+
+def load_read_states(thread_ids):
+    """Return ``{thread_id: [ThreadReadState, ...]}`` in a single query."""
+    states = defaultdict(list)
+    for state in ThreadReadState.objects.filter(thread_id__in=thread_ids):
+        states[state.thread_id].append(state)
+    return states
+
+
+def latest_message_ids(messages):
+    """Return the highest message id per thread among ``messages``."""
+    latest = {}
+    for message in messages:
+        if message.id > latest.get(message.thread_id, 0):
+            latest[message.thread_id] = message.id
+    return latest
+
+
+def advance_watermarks(user, watermarks, read=False):
+    """
+    Move ``user``'s delivered (and, with ``read=True``, read) watermarks
+    forward to the message ids in ``watermarks`` (``{thread_id: message_id}``).
+
+    Watermarks never move backwards. The whole batch takes two statements:
+    an insert for participants without a row yet and one conditional update.
+    """
+    if not watermarks:
+        return
+
+    def forward(field):
+        return models.Case(
+            *[
+                models.When(
+                    thread_id=thread_id,
+                    then=Greatest(field, models.Value(message_id)),
+                )
+                for thread_id, message_id in watermarks.items()
+            ],
+            default=models.F(field),
+            output_field=models.BigIntegerField(),
+        )
+
+    updates = {"last_delivered_message_id": forward("last_delivered_message_id")}
+    if read:
+        updates["last_read_message_id"] = forward("last_read_message_id")
+
+    with transaction.atomic():
+        ThreadReadState.objects.bulk_create(
+            [
+                ThreadReadState(thread_id=thread_id, user=user)
+                for thread_id in watermarks
+            ],
+            ignore_conflicts=True,
+        )
+        ThreadReadState.objects.filter(user=user, thread_id__in=watermarks).update(
+            **updates
+        )
+
+
+def mark_delivered(user, latest, read_states):
+    """
+    Advance ``user``'s delivered watermarks to the ``{thread_id: message_id}``
+    they were just sent, skipping the write when nothing new was delivered.
+    """
+    current = {
+        state.thread_id: state.last_delivered_message_id
+        for states in read_states.values()
+        for state in states
+        if state.user_id == user.id
+    }
+    watermarks = {
+        thread_id: message_id
+        for thread_id, message_id in latest.items()
+        if message_id > current.get(thread_id, 0)
+    }
+    advance_watermarks(user, watermarks)
+
+    # Keep the already loaded states in line with what was just written.
+    for thread_id, message_id in watermarks.items():
+        for state in read_states[thread_id]:
+            if state.user_id == user.id:
+                state.last_delivered_message_id = message_id
+                break
+        else:
+            read_states[thread_id].append(
+                ThreadReadState(
+                    thread_id=thread_id,
+                    user_id=user.id,
+                    last_delivered_message_id=message_id,
+                )
+            )
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Message, MessageThread
+from .models import Message, MessageThread, ThreadReadState
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -10,27 +10,74 @@ class UserSerializer(serializers.ModelSerializer):
         ref_name = "User"
 
 
+class ParticipantSerializer(UserSerializer):
+    presence = serializers.SerializerMethodField()
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ["presence"]
+        ref_name = "Participant"
+
+    def get_presence(self, obj):
+        # Looked up in one batch by the view and passed in through the context.
+        return self.context.get("presence", {}).get(obj.id)
+
+
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     thread = serializers.PrimaryKeyRelatedField(queryset=MessageThread.objects.all())
+    delivered_to = serializers.SerializerMethodField()
+    read_by = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields = ["id", "sender", "thread", "content", "created_at"]
+        fields = [
+            "id",
+            "sender",
+            "thread",
+            "content",
+            "created_at",
+            "delivered_to",
+            "read_by",
+        ]
         ref_name = "Message"
 
+    def get_read_states(self, obj):
+        # Loaded once per response by the view and passed in through the context.
+        states = self.context.get("read_states", {}).get(obj.thread_id, [])
+        return [state for state in states if state.user_id != obj.sender_id]
+
+    def get_delivered_to(self, obj):
+        return [
+            state.user_id
+            for state in self.get_read_states(obj)
+            if state.last_delivered_message_id >= obj.id
+        ]
+
+    def get_read_by(self, obj):
+        return [
+            state.user_id
+            for state in self.get_read_states(obj)
+            if state.last_read_message_id >= obj.id
+        ]
+
 
 class MessageThreadSerializer(serializers.ModelSerializer):
-    participants = UserSerializer(many=True, read_only=True)
+    participants = ParticipantSerializer(many=True, read_only=True)
     messages = serializers.SerializerMethodField()
+    typing = serializers.SerializerMethodField()
 
     class Meta:
         model = MessageThread
-        fields = ["id", "participants", "messages"]
+        fields = ["id", "participants", "messages", "typing"]
         ref_name = "MessageThread"
 
     def get_messages(self, obj):
-        return MessageSerializer(obj.messages.all(), many=True).data
+        return MessageSerializer(
+            obj.messages.all(), many=True, context=self.context
+        ).data
+
+    def get_typing(self, obj):
+        return self.context.get("typing", {}).get(obj.id, [])
 
 
 class SearchMessagesSerializer(serializers.ModelSerializer):
@@ -38,3 +85,19 @@ class SearchMessagesSerializer(serializers.ModelSerializer):
         model = Message
         fields = ["id", "sender", "thread", "content", "created_at"]
         ref_name = "SearchMessage"
+
+
+class MarkReadSerializer(serializers.Serializer):
+    messages = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False
+    )
+
+    class Meta:
+        ref_name = "MarkRead"
+
+
+class ThreadReadStateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ThreadReadState
+        fields = ["thread", "user", "last_delivered_message_id", "last_read_message_id"]
+        ref_name = "ThreadReadState"
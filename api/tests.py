@@ -1,8 +1,26 @@
-from django.test import TestCase
+import json
+from io import StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
-from .models import Message, MessageThread
+from .checks import check_compression_codec
+from .fields import (
+    CODEC_ZLIB,
+    MARKER,
+    CompressedText,
+    decode,
+    encode,
+    is_compressed,
+)
+from .models import Message, MessageThread, ThreadReadState
+from .presence import CachePresenceStore, InMemoryPresenceStore
+from .websocket import with_presence
 
 
 class MessageTests(TestCase):
@@ -49,3 +67,361 @@ class MessageTests(TestCase):
         self.assertEqual(Message.objects.count(), 2)
         new_message = Message.objects.last()
         self.assertEqual(new_message.content, "Hi there!")
+
+
+class MessageCompressionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user1", password="password")
+        self.thread = MessageThread.objects.create()
+        self.thread.participants.add(self.user)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def stored_content(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT content FROM api_message WHERE id = %s", [message.id]
+            )
+            return cursor.fetchone()[0]
+
+    @override_settings(MESSAGE_COMPRESSION_THRESHOLD=100)
+    def test_long_content_is_stored_compressed(self):
+        content = "log line\n" * 500
+        message = Message.objects.create(
+            thread=self.thread, sender=self.user, content=content
+        )
+        stored = self.stored_content(message)
+        self.assertTrue(is_compressed(stored))
+        self.assertLess(len(stored), len(content))
+
+        loaded = Message.objects.get(id=message.id)
+        self.assertIsInstance(loaded.content, CompressedText)
+        self.assertEqual(loaded.content, content)
+
+        response = self.client.get("/api/messages/")
+        self.assertEqual(response.json()[0]["content"], content)
+
+    @override_settings(MESSAGE_COMPRESSION_THRESHOLD=100)
+    def test_short_content_is_stored_raw(self):
+        message = Message.objects.create(
+            thread=self.thread, sender=self.user, content="Hello World"
+        )
+        self.assertEqual(self.stored_content(message), "Hello World")
+
+    def test_marker_prefixed_content_round_trips(self):
+        content = MARKER + "z:not actually compressed"
+        message = Message.objects.create(
+            thread=self.thread, sender=self.user, content=content
+        )
+        self.assertEqual(Message.objects.get(id=message.id).content, content)
+
+    def test_resave_keeps_stored_form(self):
+        content = "x" * 10000
+        message = Message.objects.create(
+            thread=self.thread, sender=self.user, content=content
+        )
+        stored = self.stored_content(message)
+        loaded = Message.objects.get(id=message.id)
+        loaded.save()
+        self.assertEqual(self.stored_content(loaded), stored)
+
+    @override_settings(MESSAGE_COMPRESSION_THRESHOLD=100)
+    def test_search_finds_compressed_content(self):
+        content = "pasted log output\n" * 100 + "Traceback: KeyError"
+        response = self.client.post(
+            "/api/messages/", {"thread": self.thread.id, "content": content}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(is_compressed(self.stored_content(Message.objects.get())))
+
+        response = self.client.get("/api/search/", {"q": "keyerror"})
+        self.assertEqual([m["content"] for m in response.json()], [content])
+
+        response = self.client.get("/api/search/", {"q": "ValueError"})
+        self.assertEqual(response.json(), [])
+
+    @override_settings(
+        MESSAGE_COMPRESSION_THRESHOLD=100, MESSAGE_SEARCH_DECOMPRESS_LIMIT=1
+    )
+    def test_search_decompresses_limited_candidates(self):
+        older, newer = [
+            Message.objects.create(
+                thread=self.thread, sender=self.user, content=f"{i} error\n" * 100
+            )
+            for i in range(2)
+        ]
+        Message.objects.create(thread=self.thread, sender=self.user, content="error")
+
+        response = self.client.get("/api/search/", {"q": "error"})
+        self.assertEqual(
+            [m["id"] for m in response.json()],
+            [newer.id, Message.objects.get(content="error").id],
+        )
+
+    def test_codec_setting_is_checked(self):
+        with override_settings(MESSAGE_COMPRESSION_CODEC="zlib"):
+            self.assertEqual(check_compression_codec(None), [])
+            self.assertTrue(encode("x" * 10000).startswith(MARKER + CODEC_ZLIB + ":"))
+        with override_settings(MESSAGE_COMPRESSION_CODEC=CODEC_ZLIB):
+            self.assertEqual(
+                [e.id for e in check_compression_codec(None)], ["api.E001"]
+            )
+        with override_settings(MESSAGE_COMPRESSION_CODEC="zstd"):
+            with mock.patch("api.fields.zstandard", None):
+                self.assertEqual(
+                    [e.id for e in check_compression_codec(None)], ["api.E002"]
+                )
+
+    def test_marker_without_separator_is_not_compressed(self):
+        self.assertFalse(is_compressed(MARKER + "zlib:abc"))
+        self.assertEqual(decode(MARKER + "zlib:abc"), MARKER + "zlib:abc")
+
+    def test_compress_messages_command(self):
+        content = "pasted log output\n" * 1000
+        with override_settings(MESSAGE_COMPRESSION_THRESHOLD=10**9):
+            long_message = Message.objects.create(
+                thread=self.thread, sender=self.user, content=content
+            )
+        short_message = Message.objects.create(
+            thread=self.thread, sender=self.user, content="Hi"
+        )
+        self.assertEqual(self.stored_content(long_message), content)
+
+        out = StringIO()
+        call_command("compress_messages", batch_size=1, stdout=out)
+        self.assertIn("Scanned 1 long messages, compressed 1", out.getvalue())
+        self.assertIn("Decompressing them once takes", out.getvalue())
+        self.assertTrue(is_compressed(self.stored_content(long_message)))
+        self.assertEqual(self.stored_content(short_message), "Hi")
+        self.assertEqual(Message.objects.get(id=long_message.id).content, content)
+
+
+class PresenceStoreTests(TestCase):
+    def test_online_expires_after_ttl(self):
+        store = InMemoryPresenceStore(online_ttl=60)
+        with mock.patch("api.presence.time.time", return_value=1000):
+            store.heartbeat(1)
+        with mock.patch("api.presence.time.time", return_value=1030):
+            self.assertTrue(store.get_many([1])[1]["online"])
+        with mock.patch("api.presence.time.time", return_value=1100):
+            presence = store.get_many([1, 2])
+        self.assertFalse(presence[1]["online"])
+        self.assertEqual(presence[1]["last_seen"].timestamp(), 1000)
+        self.assertEqual(presence[2], {"online": False, "last_seen": None})
+
+    def test_typing_expires_after_ttl(self):
+        store = InMemoryPresenceStore(typing_ttl=5)
+        with mock.patch("api.presence.time.time", return_value=1000):
+            store.set_typing(7, 1)
+            self.assertEqual(store.get_typing({7: [1, 2], 8: [1]}), {7: [1], 8: []})
+        with mock.patch("api.presence.time.time", return_value=1010):
+            self.assertEqual(store.get_typing({7: [1, 2]}), {7: []})
+
+    def test_memory_is_bounded(self):
+        store = InMemoryPresenceStore(max_entries=2)
+        for user_id in range(5):
+            store.heartbeat(user_id)
+        self.assertEqual(set(store.get_last_seen(range(5))), {3, 4})
+
+    def test_cache_store(self):
+        store = CachePresenceStore(cache_alias="default")
+        store.heartbeat(1)
+        store.set_typing(7, 2)
+        presence = store.get_many([1, 2, 3])
+        self.assertTrue(presence[1]["online"])
+        self.assertTrue(presence[2]["online"])
+        self.assertIsNone(presence[3]["last_seen"])
+        self.assertEqual(store.get_typing({7: [1, 2]}), {7: [2]})
+
+    async def test_async_updates(self):
+        for store in [InMemoryPresenceStore(), CachePresenceStore()]:
+            await store.aheartbeat(1)
+            await store.aset_typing(7, 2)
+            self.assertEqual(set(store.get_last_seen([1, 2, 3])), {1, 2})
+            self.assertEqual(store.get_typing({7: [1, 2]}), {7: [2]})
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password")
+        self.user2 = User.objects.create_user(username="user2", password="password")
+        self.thread = MessageThread.objects.create()
+        self.thread.participants.add(self.user1, self.user2)
+        self.token = Token.objects.create(user=self.user1)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        self.store = InMemoryPresenceStore()
+        patcher = mock.patch("api.presence._store", self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_thread_list_includes_presence_and_typing(self):
+        self.store.heartbeat(self.user2.id)
+        self.store.set_typing(self.thread.id, self.user2.id)
+
+        response = self.client.get("/api/threads/")
+        self.assertEqual(response.status_code, 200)
+        thread = response.json()[0]
+        presence = {p["id"]: p["presence"] for p in thread["participants"]}
+        self.assertTrue(presence[self.user2.id]["online"])
+        self.assertEqual(presence[self.user1.id], {"online": False, "last_seen": None})
+        self.assertEqual(thread["typing"], [self.user2.id])
+
+    def test_presence_adds_no_queries_per_thread(self):
+        for _ in range(3):
+            thread = MessageThread.objects.create()
+            thread.participants.add(self.user1, self.user2)
+
+        # Token auth, threads, prefetched participants, read states, then one
+        # query for each thread's messages.
+        with self.assertNumQueries(4 + 4):
+            response = self.client.get("/api/threads/")
+        self.assertEqual(len(response.json()), 4)
+
+    async def communicate(self, token, frames):
+        communicator = ApplicationCommunicator(
+            with_presence(None),
+            {
+                "type": "websocket",
+                "path": "/ws/presence/",
+                "query_string": f"token={token}".encode(),
+            },
+        )
+        await communicator.send_input({"type": "websocket.connect"})
+        response = await communicator.receive_output()
+        for frame in frames:
+            await communicator.send_input(
+                {"type": "websocket.receive", "text": json.dumps(frame)}
+            )
+        await communicator.send_input({"type": "websocket.disconnect"})
+        await communicator.wait()
+        return response
+
+    async def test_websocket_heartbeat_and_typing(self):
+        response = await self.communicate(
+            self.token.key,
+            [
+                {"type": "heartbeat"},
+                {"type": "typing", "thread": self.thread.id},
+                {"type": "typing", "thread": self.thread.id + 1},
+                {"type": "typing", "thread": [self.thread.id]},
+                {"type": "typing", "thread": {"id": self.thread.id}},
+            ],
+        )
+        self.assertEqual(response["type"], "websocket.accept")
+        self.assertTrue(self.store.get_many([self.user1.id])[self.user1.id]["online"])
+        self.assertEqual(
+            self.store.get_typing(
+                {self.thread.id: [self.user1.id], self.thread.id + 1: [self.user1.id]}
+            ),
+            {self.thread.id: [self.user1.id], self.thread.id + 1: []},
+        )
+
+    async def test_websocket_picks_up_new_threads(self):
+        communicator = ApplicationCommunicator(
+            with_presence(None),
+            {
+                "type": "websocket",
+                "path": "/ws/presence/",
+                "query_string": f"token={self.token.key}".encode(),
+            },
+        )
+        await communicator.send_input({"type": "websocket.connect"})
+        await communicator.receive_output()
+
+        thread = await MessageThread.objects.acreate()
+        await sync_to_async(thread.participants.add)(self.user1)
+        with mock.patch("api.websocket.THREAD_REFRESH_INTERVAL", 0):
+            await communicator.send_input(
+                {
+                    "type": "websocket.receive",
+                    "text": json.dumps({"type": "typing", "thread": thread.id}),
+                }
+            )
+            await communicator.send_input({"type": "websocket.disconnect"})
+            await communicator.wait()
+
+        self.assertEqual(
+            self.store.get_typing({thread.id: [self.user1.id]}),
+            {thread.id: [self.user1.id]},
+        )
+
+    async def test_websocket_rejects_invalid_token(self):
+        response = await self.communicate("invalid", [])
+        self.assertEqual(response["type"], "websocket.close")
+        self.assertFalse(self.store.get_last_seen([self.user1.id]))
+
+
+class ReadReceiptTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password")
+        self.user2 = User.objects.create_user(username="user2", password="password")
+        self.thread = MessageThread.objects.create()
+        self.thread.participants.add(self.user1, self.user2)
+        self.messages = [
+            Message.objects.create(
+                thread=self.thread, sender=self.user1, content=f"Message {i}"
+            )
+            for i in range(3)
+        ]
+
+        self.client1 = APIClient()
+        self.client1.credentials(
+            HTTP_AUTHORIZATION="Token " + Token.objects.create(user=self.user1).key
+        )
+        self.client2 = APIClient()
+        self.client2.credentials(
+            HTTP_AUTHORIZATION="Token " + Token.objects.create(user=self.user2).key
+        )
+
+    def test_fetching_messages_marks_them_delivered(self):
+        self.client2.get("/api/messages/")
+        state = ThreadReadState.objects.get(thread=self.thread, user=self.user2)
+        self.assertEqual(state.last_delivered_message_id, self.messages[-1].id)
+        self.assertEqual(state.last_read_message_id, 0)
+
+        response = self.client1.get("/api/messages/")
+        for message in response.json():
+            self.assertEqual(message["delivered_to"], [self.user2.id])
+            self.assertEqual(message["read_by"], [])
+
+    def test_mark_read(self):
+        response = self.client2.post(
+            "/api/messages/read/",
+            {"messages": [self.messages[0].id, self.messages[1].id]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()[0]["last_read_message_id"], self.messages[1].id
+        )
+
+        # Watermarks never move backwards.
+        self.client2.post(
+            "/api/messages/read/", {"messages": [self.messages[0].id]}, format="json"
+        )
+        self.assertEqual(ThreadReadState.objects.count(), 1)
+
+        response = self.client1.get("/api/threads/")
+        read_by = [m["read_by"] for m in response.json()[0]["messages"]]
+        self.assertEqual(read_by, [[self.user2.id], [self.user2.id], []])
+
+    def test_mark_read_ignores_other_threads(self):
+        outsider = User.objects.create_user(username="user3", password="password")
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION="Token " + Token.objects.create(user=outsider).key
+        )
+        response = client.post(
+            "/api/messages/read/", {"messages": [self.messages[0].id]}, format="json"
+        )
+        self.assertEqual(response.json(), [])
+        self.assertFalse(ThreadReadState.objects.exists())
+
+    def test_mark_read_requires_messages(self):
+        response = self.client2.post(
+            "/api/messages/read/", {"messages": []}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
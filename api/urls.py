@@ -6,6 +6,7 @@ from drf_yasg import openapi
 from .views import (
     MessageThreadListCreateView,
     MessageListCreateView,
+    MarkReadView,
     SendMessageView,
     SearchMessagesView,
     UserCreateView,
@@ -26,6 +27,7 @@ urlpatterns = [
     path("register/", UserCreateView.as_view(), name="user_register"),
     path("threads/", MessageThreadListCreateView.as_view(), name="threads"),
     path("messages/", MessageListCreateView.as_view(), name="messages"),
+    path("messages/read/", MarkReadView.as_view(), name="mark_read"),
     path("send/", SendMessageView.as_view(), name="send_message"),
     path("search/", SearchMessagesView.as_view(), name="search"),
     path(
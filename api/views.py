@@ -1,9 +1,27 @@
+from operator import attrgetter
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
+from django.db.models import Max, Q
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
-from .models import Message, MessageThread
-from .serializers import MessageSerializer, MessageThreadSerializer, UserSerializer
+from rest_framework.response import Response
+from .fields import MARKER
+from .models import Message, MessageThread, ThreadReadState
+from .presence import get_presence_store
+from .receipts import (
+    advance_watermarks,
+    latest_message_ids,
+    load_read_states,
+    mark_delivered,
+)
+from .serializers import (
+    MarkReadSerializer,
+    MessageSerializer,
+    MessageThreadSerializer,
+    ThreadReadStateSerializer,
+    UserSerializer,
+)
 
 
 class UserCreateView(generics.CreateAPIView):
@@ -55,6 +73,10 @@ class SendMessageView(generics.CreateAPIView):
 class MessageThreadListCreateView(generics.ListAPIView):
     """
     Retrieve message threads for the logged-in user.
+
+    Each participant includes their presence (online / last seen) and each
+    thread lists the ids of participants currently typing. Both come from the
+    presence store in one batch, without extra database queries.
     ---
     response:
       description: List of message threads
@@ -66,7 +88,39 @@ class MessageThreadListCreateView(generics.ListAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        return MessageThread.objects.filter(participants=user)
+        return (
+            MessageThread.objects.filter(participants=user)
+            .annotate(last_message_id=Max("messages__id"))
+            .prefetch_related("participants")
+        )
+
+    def list(self, request, *args, **kwargs):
+        threads = list(self.filter_queryset(self.get_queryset()))
+        participants = {
+            thread.id: [user.id for user in thread.participants.all()]
+            for thread in threads
+        }
+        user_ids = {user_id for ids in participants.values() for user_id in ids}
+
+        read_states = load_read_states(participants)
+        mark_delivered(
+            request.user,
+            {
+                thread.id: thread.last_message_id
+                for thread in threads
+                if thread.last_message_id is not None
+            },
+            read_states,
+        )
+
+        store = get_presence_store()
+        context = self.get_serializer_context()
+        context["presence"] = store.get_many(user_ids)
+        context["typing"] = store.get_typing(participants)
+        context["read_states"] = read_states
+
+        serializer = self.get_serializer(threads, many=True, context=context)
+        return Response(serializer.data)
 
 
 class MessageListCreateView(generics.ListCreateAPIView):
@@ -91,6 +145,17 @@ class MessageListCreateView(generics.ListCreateAPIView):
         # Get all messages in these threads
         return Message.objects.filter(thread__in=threads)
 
+    def list(self, request, *args, **kwargs):
+        messages = list(self.filter_queryset(self.get_queryset()))
+        read_states = load_read_states({message.thread_id for message in messages})
+        # Fetching messages is what delivers them to the logged-in user.
+        mark_delivered(request.user, latest_message_ids(messages), read_states)
+
+        context = self.get_serializer_context()
+        context["read_states"] = read_states
+        serializer = self.get_serializer(messages, many=True, context=context)
+        return Response(serializer.data)
+
     def perform_create(self, serializer):
         thread_id = self.request.data.get("thread")
         thread = get_object_or_404(MessageThread, id=thread_id)
@@ -139,12 +204,86 @@ class SearchMessagesView(generics.ListAPIView):
         # Base queryset for messages in these threads
         queryset = Message.objects.filter(thread__in=threads)
 
-        # Filter by content if provided
+        # Filter by content if provided. The database can't look inside
+        # compressed messages, so those are kept as candidates and matched
+        # after decompressing them in list().
         if query:
-            queryset = queryset.filter(content__icontains=query)
+            queryset = queryset.filter(
+                Q(content__icontains=query) | Q(content__startswith=MARKER)
+            )
         
         # Filter by thread ID if provided
         if thread_id:
             queryset = queryset.filter(thread_id=thread_id)
 
         return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        query = request.query_params.get("q", "").lower()
+        if not query:
+            messages = list(queryset)
+        else:
+            # Plain messages were already matched by the database. Compressed
+            # ones are decompressed and matched here, newest first and at most
+            # MESSAGE_SEARCH_DECOMPRESS_LIMIT of them per search.
+            limit = getattr(settings, "MESSAGE_SEARCH_DECOMPRESS_LIMIT", 200)
+            candidates = queryset.filter(content__startswith=MARKER).order_by(
+                "-created_at"
+            )[:limit]
+            matches = [
+                message
+                for message in candidates
+                if query in str(message.content).lower()
+            ]
+            messages = sorted(
+                list(queryset.exclude(content__startswith=MARKER)) + matches,
+                key=attrgetter("created_at"),
+            )
+
+        context = self.get_serializer_context()
+        context["read_states"] = load_read_states(
+            {message.thread_id for message in messages}
+        )
+        serializer = self.get_serializer(messages, many=True, context=context)
+        return Response(serializer.data)
+
+
+class MarkReadView(generics.GenericAPIView):
+    """
+    Mark messages as read for the logged-in user.
+
+    Receipts are stored as one watermark per thread, so marking a message
+    read also marks every earlier message in its thread read. Ids of messages
+    outside the user's threads are ignored.
+    ---
+    request:
+      description: Ids of the messages that were read
+      serializer: MarkReadSerializer
+    response:
+      description: The user's updated read states for the affected threads
+      serializer: ThreadReadStateSerializer
+    """
+
+    serializer_class = MarkReadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        watermarks = dict(
+            Message.objects.filter(
+                id__in=serializer.validated_data["messages"],
+                thread__participants=request.user,
+            )
+            .values("thread_id")
+            .annotate(last_id=Max("id"))
+            .values_list("thread_id", "last_id")
+        )
+        advance_watermarks(request.user, watermarks, read=True)
+
+        states = ThreadReadState.objects.filter(
+            user=request.user, thread_id__in=watermarks
+        )
+        return Response(ThreadReadStateSerializer(states, many=True).data)
@@ -0,0 +1,102 @@
+import json
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from rest_framework.authtoken.models import Token
+
+from .models import MessageThread
+from .presence import get_presence_store
+
+PRESENCE_PATH = "/ws/presence/"
+
+# Minimum number of seconds between reloads of a connection's thread ids.
+THREAD_REFRESH_INTERVAL = 10
+
+
+@sync_to_async
+def _authenticate(token_key):
+    """Return the id of the token's user, or ``None`` if it is invalid."""
+    token = Token.objects.select_related("user").filter(key=token_key).first()
+    if token is None or not token.user.is_active:
+        return None
+    return token.user.id
+
+
+@sync_to_async
+def _load_thread_ids(user_id):
+    return set(
+        MessageThread.objects.filter(participants=user_id).values_list("id", flat=True)
+    )
+
+
+async def presence_websocket(scope, receive, send):
+    """
+    WebSocket endpoint feeding the presence store.
+
+    Clients connect to ``/ws/presence/?token=<auth token>`` and send JSON
+    frames: ``{"type": "heartbeat"}`` to stay online and
+    ``{"type": "typing", "thread": <thread id>}`` while composing a message.
+    The user's threads are loaded when the connection is opened, and
+    reloaded at most every ``THREAD_REFRESH_INTERVAL`` seconds when a typing
+    frame names a thread the user was added to since then.
+    """
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+
+    query = parse_qs(scope.get("query_string", b"").decode())
+    user_id = await _authenticate(query.get("token", [""])[0])
+    if scope["path"] != PRESENCE_PATH or user_id is None:
+        await send({"type": "websocket.close", "code": 4403})
+        return
+
+    thread_ids = await _load_thread_ids(user_id)
+    refreshed_at = time.monotonic()
+    store = get_presence_store()
+    await send({"type": "websocket.accept"})
+    await store.aheartbeat(user_id)
+
+    while True:
+        event = await receive()
+        if event["type"] == "websocket.disconnect":
+            return
+        if event["type"] != "websocket.receive":
+            continue
+
+        try:
+            frame = json.loads(event.get("text") or "")
+        except ValueError:
+            continue
+        if not isinstance(frame, dict):
+            continue
+
+        thread_id = frame.get("thread")
+        # Ids must be plain integers; anything else is treated as a heartbeat.
+        if not isinstance(thread_id, int) or isinstance(thread_id, bool):
+            thread_id = None
+
+        if (
+            frame.get("type") == "typing"
+            and thread_id is not None
+            and thread_id not in thread_ids
+            and time.monotonic() - refreshed_at >= THREAD_REFRESH_INTERVAL
+        ):
+            thread_ids = await _load_thread_ids(user_id)
+            refreshed_at = time.monotonic()
+
+        if frame.get("type") == "typing" and thread_id in thread_ids:
+            await store.aset_typing(thread_id, user_id)
+        else:
+            await store.aheartbeat(user_id)
+
+
+def with_presence(http_application):
+    """Route WebSocket connections to the presence endpoint, HTTP to Django."""
+
+    async def application(scope, receive, send):
+        if scope["type"] == "websocket":
+            return await presence_websocket(scope, receive, send)
+        return await http_application(scope, receive, send)
+
+    return application
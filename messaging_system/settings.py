@@ -134,3 +134,21 @@ REST_FRAMEWORK = {
     ],
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
 }
+
+
+# Message content longer than this many characters is stored compressed.
+# Set MESSAGE_COMPRESSION_CODEC to "zstd" to use zstd (requires `zstandard`).
+MESSAGE_COMPRESSION_THRESHOLD = 4096
+MESSAGE_COMPRESSION_CODEC = "zlib"
+# Searches decompress at most this many of the newest compressed messages.
+MESSAGE_SEARCH_DECOMPRESS_LIMIT = 200
+
+# Presence and typing indicators are kept in memory, never in the database.
+# Use "api.presence.CachePresenceStore" (without "max_entries", which only
+# applies to the in-memory store) to share them between processes.
+PRESENCE_BACKEND = "api.presence.InMemoryPresenceStore"
+PRESENCE_OPTIONS = {
+    "online_ttl": 60,
+    "typing_ttl": 5,
+    "max_entries": 10000,
+}